@@ -0,0 +1,249 @@
+import argparse
+import glob
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+import common
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+# --op names of the common point transforms
+POINT_OPERATIONS = {"negative": "negative", "log": "logarithmic", "gamma": "gamma"}
+
+# Headless runner for the lab operations:
+#   python batch.py photos/ "scans/*.png" -o out --op "Gaussian 5x5" --op gamma:1:0.5 --op equalize
+# An operation is a name with optional ":"-separated parameters:
+#   any lab1 filter name              "Sharpen", "Box Blur:7", "Gaussian Blur:2.5"
+#   gray, negative, log:C, gamma:C:GAMMA, equalize
+#   a lab4 frequency mask             gaussian_lowpass:30, butterworth_highpass:20:2
+# Files are read ahead on a thread, decoded, processed and encoded in the
+# worker processes, and written back on another thread.
+
+
+def to_gray(image):
+    return image if image.ndim == 2 else common.simple_cvtColorBGRtoGray(image)
+
+def equalize(image):
+    # like lab3, equalization works on the grayscale image
+    return common.equalizeHist(to_gray(image))
+
+def check_parameters(spec, values, minimum, maximum):
+    if not minimum <= len(values) <= maximum:
+        raise ValueError(f"wrong number of parameters in {spec!r}")
+
+def parse_operation(spec):
+    name, *params = spec.split(":")
+    try:
+        values = [float(param) for param in params]
+    except ValueError:
+        raise ValueError(f"parameters of {spec!r} must be numbers") from None
+    if name == "gray":
+        check_parameters(spec, values, 0, 0)
+        return to_gray
+    if name in POINT_OPERATIONS:
+        return lambda image: common.point_transform(image, (POINT_OPERATIONS[name], *values))
+    if name == "equalize":
+        check_parameters(spec, values, 0, 0)
+        return equalize
+    if name in common.FREQUENCY_MASKS:
+        check_parameters(spec, values, 1, 2)
+        radius, order = values[0], values[1] if len(values) > 1 else 1
+        if radius <= 0 or order < 1 or order != int(order):
+            raise ValueError(f"{spec!r} needs a radius > 0 and an integer order >= 1")
+        return lambda image: common.frequency_filter(image, name, radius, int(order))
+
+    # the lab1 filters, lab1 is only imported when one is asked for
+    import lab1
+
+    for available_filter in lab1.available_filters:
+        if available_filter.name == name:
+            if isinstance(available_filter, lab1.BlurFilter):
+                check_parameters(spec, values, 0, 1)
+                value = values[0] if values else available_filter.value
+                # the lower end of the lab1 slider
+                if value < available_filter.from_:
+                    raise ValueError(f"{spec!r} needs a value >= {available_filter.from_}")
+                return lambda image: available_filter.function(image, value)
+            check_parameters(spec, values, 0, 0)
+            return available_filter.apply
+    raise ValueError(f"unknown operation {spec!r}")
+
+@lru_cache(maxsize=None)
+def operations(specs):
+    # a run of point transforms becomes one stage applying their combined LUT,
+    # built here so bad parameters fail before any worker starts
+    stages = []
+    index = 0
+    while index < len(specs):
+        luts = []
+        while index < len(specs) and specs[index].split(":")[0] in POINT_OPERATIONS:
+            name, *params = specs[index].split(":")
+            try:
+                luts.append(common.point_lut(POINT_OPERATIONS[name], *[float(param) for param in params]))
+            except TypeError:
+                raise ValueError(f"wrong number of parameters in {specs[index]!r}") from None
+            except ValueError:
+                raise ValueError(f"parameters of {specs[index]!r} must be numbers") from None
+            index += 1
+        if luts:
+            name = " + ".join(specs[index - len(luts):index])
+            lut = common.compose_luts(luts)
+            stages.append((name, lambda image, lut=lut: common.apply_lut_parallel(image, lut)))
+        else:
+            stages.append((specs[index], parse_operation(specs[index])))
+            index += 1
+    return stages
+
+
+def init_worker(threads):
+    # every worker process gets an equal share of the cores for numba
+    common.set_parallelism(threads=threads)
+
+def process(data, specs, extension):
+    # returns the encoded result and (stage, seconds, input bytes) per stage
+    stages = []
+    start = time.perf_counter()
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("can't decode image")
+    stages.append(("decode", time.perf_counter() - start, len(data)))
+
+    for spec, operation in operations(specs):
+        start = time.perf_counter()
+        size = image.nbytes
+        image = operation(image)
+        stages.append((spec, time.perf_counter() - start, size))
+
+    start = time.perf_counter()
+    ok, encoded = cv2.imencode(extension, image)
+    if not ok:
+        raise ValueError(f"can't encode {extension}")
+    stages.append(("encode", time.perf_counter() - start, image.nbytes))
+    return encoded.tobytes(), stages
+
+
+def read_file(path):
+    start = time.perf_counter()
+    with open(path, "rb") as file:
+        data = file.read()
+    return data, time.perf_counter() - start
+
+def write_file(path, data):
+    start = time.perf_counter()
+    with open(path, "wb") as file:
+        file.write(data)
+    return time.perf_counter() - start
+
+def collect_inputs(inputs):
+    paths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            names = sorted(os.listdir(pattern))
+            paths += [os.path.join(pattern, name) for name in names if name.lower().endswith(IMAGE_EXTENSIONS)]
+        else:
+            paths += sorted(glob.glob(pattern))
+    return paths
+
+
+class StageStats:
+    # per-stage busy time summed over the workers, so images/s and MB/s are
+    # the throughput of one worker in that stage
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, seconds, size):
+        images, total_seconds, total_size = self.stages.get(stage, (0, 0.0, 0))
+        self.stages[stage] = (images + 1, total_seconds + seconds, total_size + size)
+
+    def report(self, wall_time, processed):
+        print(f"{'stage':<28}{'images':>8}{'seconds':>10}{'images/s':>10}{'MB/s':>10}")
+        for stage, (images, seconds, size) in self.stages.items():
+            seconds = max(seconds, 1e-9)
+            print(f"{stage:<28}{images:>8}{seconds:>10.3f}{images / seconds:>10.1f}{size / seconds / 1e6:>10.1f}")
+        print(f"{'total (wall)':<28}{processed:>8}{wall_time:>10.3f}{processed / max(wall_time, 1e-9):>10.1f}")
+
+
+def run(args):
+    specs = tuple(args.op)
+    # fail on a bad chain before any process is started
+    try:
+        operations(specs)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 2
+    paths = collect_inputs(args.inputs)
+    if not paths:
+        print("no input images", file=sys.stderr)
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+
+    workers = args.workers or os.cpu_count()
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    stats = StageStats()
+    failed = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(threads,)) as pool, \
+            ThreadPoolExecutor(1) as reader, ThreadPoolExecutor(1) as writer:
+        remaining = iter(paths)
+        reads = deque()
+        jobs = deque()
+        writes = []
+
+        def read_ahead():
+            path = next(remaining, None)
+            if path is not None:
+                reads.append((path, reader.submit(read_file, path)))
+
+        for _ in range(max(1, args.prefetch)):
+            read_ahead()
+
+        while reads or jobs:
+            # keep every worker busy with one queued image behind it
+            while reads and len(jobs) < 2 * workers:
+                path, read = reads.popleft()
+                data, seconds = read.result()
+                stats.add("read", seconds, len(data))
+                name, extension = os.path.splitext(os.path.basename(path))
+                extension = args.format or extension
+                jobs.append((path, name + extension, pool.submit(process, data, specs, extension)))
+                read_ahead()
+
+            path, name, job = jobs.popleft()
+            try:
+                encoded, stages = job.result()
+            except Exception as error:
+                print(f"{path}: {error}", file=sys.stderr)
+                failed += 1
+                continue
+            for stage, seconds, size in stages:
+                stats.add(stage, seconds, size)
+            writes.append((len(encoded), writer.submit(write_file, os.path.join(args.output, name), encoded)))
+
+        for size, write in writes:
+            stats.add("write", write.result(), size)
+
+    stats.report(time.perf_counter() - start, len(paths) - failed)
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply a chain of lab operations to many images")
+    parser.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("--op", action="append", default=[], help="operation, applied in the given order")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes, all cores by default")
+    parser.add_argument("--prefetch", type=int, default=8, help="files read ahead of the workers")
+    parser.add_argument("--format", help="output extension such as .png, the input one by default")
+    args = parser.parse_args()
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def first_result_times():
+    # runs in a fresh interpreter, every time is measured from process start
+    start = time.perf_counter()
+    import numpy as np
+    import common
+
+    times = {"import": time.perf_counter() - start}
+    image = np.random.default_rng(0).integers(0, 256, (512, 512, 3), dtype=np.uint8)
+    kernel = np.array([[1, 2, 1], [2, 4, 2], [1, 2, 1]]) / 16
+
+    common.filter2D(image, kernel)
+    times["filter2D"] = time.perf_counter() - start
+    gray = common.simple_cvtColorBGRtoGray(image)
+    common.equalizeHist(gray)
+    times["equalizeHist"] = time.perf_counter() - start
+    common.irfft2(common.rfft2(gray), gray.shape[1])
+    times["rfft2"] = time.perf_counter() - start
+    return times
+
+
+def run_startup_child(cache_dir):
+    env = dict(os.environ, NUMBA_CACHE_DIR=cache_dir)
+    output = subprocess.run(
+        [sys.executable, __file__, "startup", "--child"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def startup(args):
+    if args.child:
+        print(json.dumps(first_result_times()))
+        return
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        results = {
+            "cold cache": run_startup_child(cache_dir),
+            "warm cache": run_startup_child(cache_dir),
+        }
+
+    print(f"{'time to first result (s)':<28}" + "".join(f"{name:>14}" for name in results))
+    for stage in results["cold cache"]:
+        print(f"{stage:<28}" + "".join(f"{run[stage]:>14.3f}" for run in results.values()))
+
+
+def best_time(function, repeat=3):
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def unroll(args):
+    # generic loop vs generated unrolled stencil for every odd kernel size
+    import numpy as np
+    import common
+
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (args.size, args.size, 3), dtype=np.uint8)
+    print(f"{'kernel':<8}{'generic (s)':>14}{'unrolled (s)':>14}{'speedup':>10}")
+    for k_size in range(3, args.max_kernel + 1, 2):
+        kernel = (rng.random((k_size, k_size)) / k_size**2).astype(np.float32)
+        stencil = common.unrolled_stencil(k_size, kernel.dtype, common.BORDER_CONSTANT)
+        generic = best_time(lambda: common.core_filter2D(image, kernel, common.BORDER_CONSTANT, 1.0, 0.5))
+        unrolled = best_time(lambda: stencil(image, kernel, 1.0, 0.5))
+        print(f"{f'{k_size}x{k_size}':<8}{generic:>14.4f}{unrolled:>14.4f}{generic / unrolled:>10.2f}")
+
+
+# Synthetic image sizes for the suite as (height, width)
+SUITE_SIZES = {
+    "256": (256, 256),
+    "1024": (1024, 1024),
+    "2048": (2048, 2048),
+    "4K": (2160, 3840),
+    "8K": (4320, 7680),
+}
+SUITE_KERNEL_SIZES = (3, 5, 7, 9, 11, 15)
+REGRESSION_TOLERANCE = 0.10
+
+
+def suite_cases(image, rng):
+    # (operation, our function, reference function or None)
+    import cv2
+    import numpy as np
+    import common
+    import lab1
+
+    gray = common.simple_cvtColorBGRtoGray(image)
+    cases = [
+        ("cvtColorBGRtoGray", lambda: common.simple_cvtColorBGRtoGray(image),
+         lambda: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)),
+    ]
+    for available_filter in lab1.available_filters:
+        if isinstance(available_filter, lab1.BlurFilter):
+            if available_filter.function is common.boxFilter:
+                size = 2 * available_filter.value + 1
+                reference = lambda: cv2.blur(image, (size, size), borderType=cv2.BORDER_CONSTANT)
+            else:
+                sigma = available_filter.value
+                reference = lambda: cv2.GaussianBlur(image, (0, 0), sigma, borderType=cv2.BORDER_CONSTANT)
+        else:
+            matrix = available_filter.matrix.astype(np.float32)
+            reference = lambda matrix=matrix: cv2.filter2D(image, -1, matrix, borderType=cv2.BORDER_CONSTANT)
+        cases.append((f"filter2D {available_filter.name}", lambda f=available_filter: f.apply(image), reference))
+    for k_size in SUITE_KERNEL_SIZES:
+        kernel = (rng.random((k_size, k_size)) / k_size**2).astype(np.float32)
+        cases.append((
+            f"filter2D random {k_size}x{k_size}",
+            lambda kernel=kernel: common.filter2D(image, kernel),
+            lambda kernel=kernel: cv2.filter2D(image, -1, kernel, borderType=cv2.BORDER_CONSTANT),
+        ))
+
+    spectrum = np.fft.fft2(gray)
+    shape = gray.shape
+
+    def mask_build():
+        common.frequency_mask.cache_clear()
+        common.frequency_distance.cache_clear()
+        common.frequency_mask(shape, "butterworth_lowpass", 30, 2)
+
+    def mask_reference():
+        u = np.arange(shape[0]) - shape[0] // 2
+        v = np.arange(shape[1]) - shape[1] // 2
+        distance = np.sqrt(u[:, None] ** 2 + v[None, :] ** 2)
+        return 1 / (1 + (distance / 30) ** 4)
+
+    cases += [
+        ("histogram_parallel", lambda: common.histogram_parallel(gray),
+         lambda: np.bincount(gray.ravel(), minlength=256)),
+        ("equalizeHist", lambda: common.equalizeHist(gray), lambda: cv2.equalizeHist(gray)),
+        ("equalizeHistCLAHE", lambda: common.equalizeHistCLAHE(gray, 2.0),
+         lambda: cv2.createCLAHE(2.0, (8, 8)).apply(gray)),
+        ("fft2", lambda: common.fft2(gray), lambda: np.fft.fft2(gray)),
+        ("ifft2", lambda: common.ifft2(spectrum), lambda: np.fft.ifft2(spectrum)),
+        ("frequency_mask", mask_build, mask_reference),
+    ]
+    return cases
+
+
+def suite_threads(args):
+    import numba
+
+    if args.threads:
+        return [int(n) for n in args.threads.split(",")]
+    counts, n = [], 1
+    while n < numba.config.NUMBA_NUM_THREADS:
+        counts.append(n)
+        n *= 2
+    return counts + [numba.config.NUMBA_NUM_THREADS]
+
+
+def compare_results(results, previous_path):
+    with open(previous_path) as file:
+        previous = {
+            (entry["operation"], tuple(entry["size"]), entry["threads"]): entry["seconds"]
+            for entry in json.load(file)["results"]
+        }
+    regressions = 0
+    print(f"\n{'compared to ' + previous_path:<44}{'old (s)':>10}{'new (s)':>10}{'ratio':>8}")
+    for entry in results:
+        key = (entry["operation"], tuple(entry["size"]), entry["threads"])
+        if key not in previous:
+            continue
+        ratio = entry["seconds"] / previous[key]
+        flag = ""
+        if ratio > 1 + REGRESSION_TOLERANCE:
+            flag = "  REGRESSION"
+            regressions += 1
+        name = f"{entry['operation']} {entry['size'][0]}x{entry['size'][1]} t={entry['threads']}"
+        print(f"{name:<44}{previous[key]:>10.4f}{entry['seconds']:>10.4f}{ratio:>8.2f}{flag}")
+    return regressions
+
+
+def suite(args):
+    import platform
+    import numpy as np
+    import numba
+    import common
+
+    rng = np.random.default_rng(0)
+    threads = suite_threads(args)
+    pattern = args.operations.lower() if args.operations else None
+    results = []
+    print(f"{'operation':<40}{'size':>12}{'threads':>8}{'ours (s)':>10}{'ref (s)':>10}{'speedup':>9}")
+    for size_name in args.sizes.split(","):
+        h, w = SUITE_SIZES[size_name]
+        image = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+        for operation, function, reference in suite_cases(image, rng):
+            if pattern and pattern not in operation.lower():
+                continue
+            # the reference libraries pick their own thread counts, so they are timed once
+            reference_time = best_time(reference, args.repeat) if reference else None
+            for n_threads in threads:
+                common.set_parallelism(threads=n_threads)
+                seconds = best_time(function, args.repeat)
+                results.append({
+                    "operation": operation,
+                    "size": [h, w],
+                    "threads": n_threads,
+                    "seconds": seconds,
+                    "reference_seconds": reference_time,
+                })
+                ratio = f"{reference_time / seconds:>9.2f}" if reference_time else f"{'-':>9}"
+                reference_text = f"{reference_time:>10.4f}" if reference_time else f"{'-':>10}"
+                print(f"{operation:<40}{f'{h}x{w}':>12}{n_threads:>8}{seconds:>10.4f}{reference_text}{ratio}")
+    common.set_parallelism(threads=numba.config.NUMBA_NUM_THREADS)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({
+                "machine": {
+                    "platform": platform.platform(),
+                    "processor": platform.processor(),
+                    "cpu_count": os.cpu_count(),
+                    "numba": numba.__version__,
+                    "numpy": np.__version__,
+                },
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+            }, file, indent=1)
+    if args.compare and compare_results(results, args.compare):
+        sys.exit(1)
+
+
+def scaling(args):
+    # speedup of every suite kernel over its single-threaded time
+    import numpy as np
+    import numba
+    import common
+
+    if args.threading_layer:
+        common.set_parallelism(threading_layer=args.threading_layer)
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (args.size, args.size, 3), dtype=np.uint8)
+    threads = suite_threads(args)
+    pattern = args.operations.lower() if args.operations else None
+    print(f"{'speedup vs 1 thread':<40}" + "".join(f"{f't={n}':>8}" for n in threads))
+    for operation, function, _ in suite_cases(image, rng):
+        if pattern and pattern not in operation.lower():
+            continue
+        times = []
+        for n_threads in threads:
+            common.set_parallelism(threads=n_threads)
+            times.append(best_time(function, args.repeat))
+        print(f"{operation:<40}" + "".join(f"{times[0] / seconds:>8.2f}" for seconds in times))
+    common.set_parallelism(threads=numba.config.NUMBA_NUM_THREADS)
+    print(f"threading layer: {common.get_parallelism()['threading_layer']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the common.py kernels")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    startup_parser = commands.add_parser("startup", help="time to first result with a cold and a warm JIT cache")
+    startup_parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    startup_parser.set_defaults(run=startup)
+
+    unroll_parser = commands.add_parser("unroll", help="generic vs unrolled filter2D stencil per kernel size")
+    unroll_parser.add_argument("--size", type=int, default=2048, help="image side length")
+    unroll_parser.add_argument("--max-kernel", type=int, default=15)
+    unroll_parser.set_defaults(run=unroll)
+
+    suite_parser = commands.add_parser("suite", help="every kernel against cv2/numpy, per size and thread count")
+    suite_parser.add_argument("--sizes", default="256,1024,2048,4K,8K", help="comma separated: " + ",".join(SUITE_SIZES))
+    suite_parser.add_argument("--threads", help="comma separated thread counts, powers of two up to all cores by default")
+    suite_parser.add_argument("--operations", help="only operations whose name contains this text")
+    suite_parser.add_argument("--repeat", type=int, default=3)
+    suite_parser.add_argument("--output", help="write the results to this JSON file")
+    suite_parser.add_argument("--compare", help="JSON file of an earlier run, exits with 1 on a regression")
+    suite_parser.set_defaults(run=suite)
+
+    scaling_parser = commands.add_parser("scaling", help="speedup per kernel from 1 to all cores")
+    scaling_parser.add_argument("--size", type=int, default=2048, help="image side length")
+    scaling_parser.add_argument("--threads", help="comma separated thread counts, powers of two up to all cores by default")
+    scaling_parser.add_argument("--operations", help="only operations whose name contains this text")
+    scaling_parser.add_argument("--threading-layer", choices=("default", "tbb", "omp", "workqueue"))
+    scaling_parser.add_argument("--repeat", type=int, default=3)
+    scaling_parser.set_defaults(run=scaling)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
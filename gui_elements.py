@@ -1,7 +1,19 @@
+import queue
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
 import tkinter as tk
 from tkinter import ttk, Menu
 import sv_ttk
 
+SCHEDULER_WORKERS = 2
+SCHEDULER_POLL_MS = 10
+# debounce windows for widgets that fire on every key press or mouse move
+KEY_DEBOUNCE_MS = 150
+SLIDER_DEBOUNCE_MS = 30
+# a full resolution refinement starts once the previews pause this long
+REFINE_DELAY_MS = 150
+
 
 class SliderContainer(ttk.Frame):
     def __init__(self, master, label_text, **slider_params):
@@ -77,11 +89,131 @@ class MenuContainer(Menu):
                 self.add_command(label=label, command=command)
 
 
+class TaskCancelled(Exception):
+    pass
+
+
+class ComputeTask:
+    # handed to every job; long jobs call check() between their stages
+    def __init__(self, scheduler, key, generation):
+        self.scheduler = scheduler
+        self.key = key
+        self.generation = generation
+
+    @property
+    def cancelled(self):
+        return self.scheduler.generations.get(self.key) != self.generation
+
+    def check(self):
+        if self.cancelled:
+            raise TaskCancelled()
+
+
+class ComputeScheduler:
+    # Runs heavy GUI work off the Tk thread. Jobs are grouped by key (usually
+    # one per widget or view): a new submit supersedes everything older with
+    # the same key, a debounce window lets a burst of events collapse into one
+    # job, and at most one job per key runs at a time, with the newest waiting
+    # behind it. Results come back through a queue polled with after(), so
+    # on_done and on_error always run on the Tk thread, and only for the
+    # latest job of their key.
+    def __init__(self, root, workers=SCHEDULER_WORKERS):
+        self.root = root
+        # numba kernels release the GIL, so threads are enough
+        self.executor = ThreadPoolExecutor(workers)
+        self.results = queue.Queue()
+        self.generations = {}
+        self.debounced = {}
+        self.running = set()
+        self.waiting = {}
+        self.root.after(SCHEDULER_POLL_MS, self._poll)
+
+    def submit(self, key, job, on_done=None, on_error=None, debounce_ms=0):
+        # job(task) runs on a worker; read every Tk variable before submitting
+        generation = self.generations.get(key, 0) + 1
+        self.generations[key] = generation
+        if key in self.debounced:
+            self.root.after_cancel(self.debounced.pop(key))
+        request = (generation, job, on_done, on_error)
+        if debounce_ms:
+            self.debounced[key] = self.root.after(debounce_ms, lambda: self._start(key, request))
+        else:
+            self._start(key, request)
+
+    def submit_progressive(self, key, preview_job, on_preview, job, on_done, on_error=None,
+                           debounce_ms=0, refine_ms=REFINE_DELAY_MS):
+        # a cheap preview first, then the full job under the same key, so any
+        # newer request supersedes the refinement whether it waits or runs
+        def preview_done(result):
+            on_preview(result)
+            self.submit(key, job, on_done, on_error, debounce_ms=refine_ms)
+
+        self.submit(key, preview_job, preview_done, on_error, debounce_ms=debounce_ms)
+
+    def cancel(self, key):
+        self.generations[key] = self.generations.get(key, 0) + 1
+        if key in self.debounced:
+            self.root.after_cancel(self.debounced.pop(key))
+        self.waiting.pop(key, None)
+
+    def _start(self, key, request):
+        self.debounced.pop(key, None)
+        if request[0] != self.generations.get(key):
+            return
+        if key in self.running:
+            # the running job sees it is stale at its next check()
+            self.waiting[key] = request
+            return
+        generation, job, on_done, on_error = request
+        self.running.add(key)
+        task = ComputeTask(self, key, generation)
+        self.executor.submit(self._run, task, job, on_done, on_error)
+
+    def _run(self, task, job, on_done, on_error):
+        try:
+            result, error = job(task), None
+        except TaskCancelled:
+            result, error = None, TaskCancelled()
+        except Exception as exception:
+            result, error = None, exception
+        self.results.put((task, result, error, on_done, on_error))
+
+    def _poll(self):
+        # re-armed first, so a failing callback can't stop result delivery
+        self.root.after(SCHEDULER_POLL_MS, self._poll)
+        while True:
+            try:
+                task, result, error, on_done, on_error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.running.discard(task.key)
+            if task.key in self.waiting:
+                self._start(task.key, self.waiting.pop(task.key))
+            if task.cancelled or isinstance(error, TaskCancelled):
+                continue
+            try:
+                if error is not None:
+                    if on_error:
+                        on_error(error)
+                    else:
+                        traceback.print_exception(error)
+                elif on_done:
+                    on_done(result)
+            except Exception as exception:
+                traceback.print_exception(exception)
+
+    def shutdown(self):
+        for key in list(self.generations):
+            self.cancel(key)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
 class MainWindow(tk.Tk):
     def __init__(self, title, image_viewer):
         super().__init__()
         self.title(title)
         self.image_viewer = image_viewer
+        self.scheduler = ComputeScheduler(self)
 
     def set_menu_container(self, menu_container):
         self.menu_container = menu_container
@@ -94,3 +226,4 @@ class MainWindow(tk.Tk):
         sv_ttk.set_theme("dark")
 
         self.mainloop()
+        self.scheduler.shutdown()
@@ -1,4 +1,5 @@
 import cv2
+import numpy as np
 from time import sleep
 
 
@@ -21,12 +22,19 @@ class ImageViewer:
         # 50 fps
         self.update_interval = 0.02
         self.dead = False
+        # bumped on every set_image so callers can tell images apart cheaply
+        self.image_version = 0
+        # (low resolution image, ROI bounds it was computed for) or None
+        self.preview = None
+        self.window_size = (MAXIMUM_WIDTH, MAXIMUM_HEIGHT)
         self.__update_window_size()
 
     def set_image(self, image):
         if image is None:
             return
         self.image = image
+        self.image_version += 1
+        self.preview = None
         if (
             self.roi_center is None
             or self.roi_center[0] > self.image.shape[1]
@@ -68,6 +76,24 @@ class ImageViewer:
         return self.image;
 
     def get_roi(self):
+        y1, y2, x1, x2 = self.get_roi_bounds()
+        return self.image[y1:y2, x1:x2]
+
+    def get_preview_source(self, image):
+        # the ROI of image subsampled to about the resolution the window shows
+        # it at; returns (proxy, step, bounds), a step of 1 means no proxy is needed
+        bounds = self.get_roi_bounds()
+        y1, y2, x1, x2 = bounds
+        width, height = self.window_size
+        step = max(1, (x2 - x1) // max(width, 1), (y2 - y1) // max(height, 1))
+        return np.ascontiguousarray(image[y1:y2:step, x1:x2:step]), step, bounds
+
+    def set_preview(self, image, bounds):
+        # shown instead of the ROI of the current image until the next
+        # set_image, and only while the viewport stays at bounds
+        self.preview = (image, bounds)
+
+    def get_roi_bounds(self):
         H, W = self.image.shape[:2]
         roi_W, roi_H = int(W / self.scale), int(H / self.scale)
         roi_W = max(roi_W, 1)
@@ -95,9 +121,13 @@ class ImageViewer:
                 y2 = y1 + roi_H
             else:  # ROI is at the bottom edge
                 y1 = y2 - roi_H
-        return self.image[y1:y2, x1:x2]
+        return y1, y2, x1, x2
 
     def __show_image(self):
+        preview = self.preview
+        if preview is not None and preview[1] == self.get_roi_bounds():
+            cv2.imshow(self.window_name, preview[0])
+            return
         roi = self.get_roi()
         cv2.imshow(self.window_name, roi)
 
@@ -111,11 +141,14 @@ class ImageViewer:
         if is_wide:
             if width > MAXIMUM_WIDTH:
                 width = MAXIMUM_WIDTH
-            cv2.resizeWindow(self.window_name, width, int(width * self.aspect_ratio))
+            height = int(width * self.aspect_ratio)
         else:
             if height > MAXIMUM_HEIGHT:
                 height = MAXIMUM_HEIGHT
-            cv2.resizeWindow(self.window_name, int(height / self.aspect_ratio), height)
+            width = int(height / self.aspect_ratio)
+        cv2.resizeWindow(self.window_name, width, height)
+        if width > 0 and height > 0:
+            self.window_size = (width, height)
 
     def __mouse_events(self, event, x, y, flags, param):
         self.__update_window_size()
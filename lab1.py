@@ -3,26 +3,45 @@ import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 import threading
 from image_viewer import ImageViewer
-from gui_elements import SliderContainer, RadioContainer, MenuContainer, MainWindow
+from gui_elements import SliderContainer, RadioContainer, MenuContainer, MainWindow, KEY_DEBOUNCE_MS, SLIDER_DEBOUNCE_MS
 import common
 
 
 
 class Filter:
-    def __init__(self, name, matrix):
+    def __init__(self, name, matrix, normalize=True):
         self.name = name
         if isinstance(matrix, np.ndarray):
             self.matrix = matrix
         else:
             self.matrix = np.array(matrix)
         sum = np.sum(self.matrix)
-        if sum != 0 and sum != 1:
+        if normalize and sum != 0 and sum != 1:
             self.matrix = self.matrix / sum
 
+    def apply(self, image, scale=1.0):
+        # scale < 1 for a downscaled preview; a matrix can't follow it
+        return common.filter2D(image, self.matrix)
+
     def __str__(self):
         return self.name
 
 
+class BlurFilter(Filter):
+    # blur with a radius/sigma parameter instead of a fixed matrix
+    def __init__(self, name, function, parameter_label, from_, to, value):
+        super().__init__(name, [[1]])
+        self.function = function
+        self.parameter_label = parameter_label
+        self.from_ = from_
+        self.to = to
+        self.value = value
+
+    def apply(self, image, scale=1.0):
+        # radius / sigma are in pixels, so they shrink with a preview
+        return self.function(image, self.value * scale)
+
+
 available_filters = [
     Filter("No filter", [[1]]),
     Filter("Gaussian 3x3", np.array([[1, 2, 1], [2, 4, 2], [1, 2, 1]])),
@@ -68,6 +87,8 @@ available_filters = [
     Filter("Edge detection", [[1, 1, 1], [1, -2, 1], [-1, -1, -1]]),
     Filter("Sharpen", [[-1, -1, -1], [-1, 16, -1], [-1, -1, -1]]),
     Filter("Softening", [[2, 2, 2], [2, 0, 2], [2, 2, 2]]),
+    BlurFilter("Box Blur", common.boxFilter, "Radius:", 1, 100, 5),
+    BlurFilter("Gaussian Blur", common.GaussianBlur, "Sigma:", 0.5, 50, 3),
 ]
 
 current_filter_index = 0
@@ -90,6 +111,7 @@ class FilterContainer(ttk.Frame):
         self.grid_rowconfigure(1, weight=1)  # listbox
         self.grid_rowconfigure(2, weight=0)  # buttons
         self.grid_rowconfigure(3, weight=1)  # matrix_frame
+        self.grid_rowconfigure(4, weight=0)  # parameter_frame
 
         # Convert to Grayscale Button
         self.grayscale_button = ttk.Button(
@@ -127,6 +149,12 @@ class FilterContainer(ttk.Frame):
 
         self.cells = []
 
+        # Radius / sigma slider of the blur filters
+        self.parameter_frame = ttk.Frame(self)
+        self.parameter_frame.grid(row=4, column=0, columnspan=2, sticky="ew")
+
+        self.parameter_slider = None
+
     def notify_image_changed(self):
         if self.grayscale:
             self.grayscale = not self.grayscale
@@ -149,16 +177,35 @@ class FilterContainer(ttk.Frame):
         index = self.listbox.curselection()
         if index:
             selected_filter = available_filters[index[0]]
-            self.filtered_image = self.apply_filter(selected_filter.matrix)
-            self.push_image()
+            self.schedule_filter(selected_filter)
         else:
+            self.master.scheduler.cancel("filter")
             self.filtered_image = self.prefiltered_image
             self.push_image()
 
-    def apply_filter(self, matrix):
-        if self.prefiltered_image is not None:
-            return common.filter2D(self.prefiltered_image, matrix)
-        return None
+    def schedule_filter(self, image_filter, debounce_ms=0):
+        # filtering runs on the scheduler, a newer request replaces an older one;
+        # big images get a preview at the viewer's resolution first
+        image = self.prefiltered_image
+        if image is None:
+            return
+
+        def on_done(filtered_image):
+            self.filtered_image = filtered_image
+            self.push_image()
+
+        proxy, step, bounds = self.image_viewer.get_preview_source(image)
+        if step == 1:
+            self.master.scheduler.submit("filter", lambda task: image_filter.apply(image), on_done, debounce_ms=debounce_ms)
+            return
+        self.master.scheduler.submit_progressive(
+            "filter",
+            lambda task: image_filter.apply(proxy, 1 / step),
+            lambda preview: self.image_viewer.set_preview(preview, bounds),
+            lambda task: image_filter.apply(image),
+            on_done,
+            debounce_ms=debounce_ms,
+        )
 
     def push_image(self):
         self.image_viewer.set_image(self.filtered_image)
@@ -173,8 +220,7 @@ class FilterContainer(ttk.Frame):
                     new_row.append(value)
                 temp_matrix.append(new_row)
             temp_matrix = np.array(temp_matrix)
-            self.filtered_image = self.apply_filter(temp_matrix)
-            self.push_image()
+            self.schedule_filter(Filter("Live", temp_matrix, normalize=False), KEY_DEBOUNCE_MS)
         except ValueError:
             pass  # If there's an error, probably because of incomplete input, so just pass
 
@@ -183,9 +229,37 @@ class FilterContainer(ttk.Frame):
         if index:
             selected_filter = available_filters[index[0]]
             current_filter = index[0]
-            self.filtered_image = self.apply_filter(selected_filter.matrix)
-            self.display_matrix(selected_filter.matrix)
-            self.push_image()
+            self.schedule_filter(selected_filter)
+            if isinstance(selected_filter, BlurFilter):
+                # a blur has no matrix to edit
+                self.edit_button.state(["disabled"])
+                self.create_matrix_viewer(0, 0)
+                self.display_parameter(selected_filter)
+            else:
+                self.edit_button.state(["!disabled"])
+                self.display_parameter(None)
+                self.display_matrix(selected_filter.matrix)
+
+    def display_parameter(self, blur_filter):
+        if self.parameter_slider is not None:
+            self.parameter_slider.destroy()
+            self.parameter_slider = None
+        if blur_filter is None:
+            return
+
+        def on_parameter_change(value):
+            blur_filter.value = value
+            self.schedule_filter(blur_filter, SLIDER_DEBOUNCE_MS)
+
+        self.parameter_slider = SliderContainer(
+            self.parameter_frame,
+            blur_filter.parameter_label,
+            from_=blur_filter.from_,
+            to=blur_filter.to,
+            orient=tk.HORIZONTAL,
+            callback=on_parameter_change,
+        )
+        self.parameter_slider.slider.set(blur_filter.value)
 
     def create_matrix_viewer(self, rows, cols):
         for row in self.cells:
@@ -214,6 +288,8 @@ class FilterContainer(ttk.Frame):
         self.update()
 
     def edit_filter(self):
+        if not self.cells:
+            return
 
         try:
             new_matrix = []
@@ -226,8 +302,7 @@ class FilterContainer(ttk.Frame):
             new_matrix = np.array(new_matrix)
             available_filters[current_filter_index].matrix = new_matrix
             messagebox.showinfo("Success", "Filter matrix updated successfully!")
-            self.filtered_image = self.apply_filter(new_matrix)
-            self.push_image()
+            self.schedule_filter(Filter("Edited", new_matrix, normalize=False))
         except ValueError:
             messagebox.showerror("Error", "Invalid value in matrix!")
 
@@ -250,6 +325,8 @@ class FilterContainer(ttk.Frame):
 
 
 if __name__ == "__main__":
+    common.prepare_gui_kernels()
+
     viewer = ImageViewer()
     main_window = MainWindow("ToneMapping GUI", viewer)
 
@@ -1,20 +1,21 @@
-﻿import numpy as np
-import tkinter as tk
+﻿import tkinter as tk
 from tkinter import ttk
 import threading
 
 from image_viewer import ImageViewer
-from gui_elements import SliderContainer, RadioContainer, MenuContainer, MainWindow
+from gui_elements import SliderContainer, RadioContainer, MenuContainer, MainWindow, SLIDER_DEBOUNCE_MS
 import common
 
 
 
 class TransformationContainer(ttk.Frame):
+    # each entry reads its slider values and returns the chain of point
+    # transforms, which runs on the scheduler as a single cached LUT
     TRANSFORMATIONS = {
-        "none": lambda self, img: img,
-        "negative": lambda self, img: 256 - 1 - img,
-        "logarithmic": lambda self, img: self.logarithmic_transformation(img),
-        "gamma": lambda self, img: self.gamma_transformation(img),
+        "none": lambda self: [],
+        "negative": lambda self: [("negative",)],
+        "logarithmic": lambda self: [self.logarithmic_transformation()],
+        "gamma": lambda self: [self.gamma_transformation()],
     }
 
     def __init__(self, master, image_viewer, **kwargs):
@@ -72,31 +73,49 @@ class TransformationContainer(ttk.Frame):
         )
         self.radio_container.pack(pady=5, fill=tk.X)
 
-    def logarithmic_transformation(self, img):
+    def logarithmic_transformation(self):
         c = self.c_log_slider.get_value()
-        img_value = img.astype(np.float32)
-        transformed_img = 255 / np.log(1 + pow(10, c) * 255) * np.log(1 + pow(10, c) * img_value)
-        return np.clip(transformed_img, 0, 255).astype(np.uint8)
+        return ("logarithmic", c)
 
-    def gamma_transformation(self, img):
+    def gamma_transformation(self):
         c_gamma = self.c_gamma_slider.get_value()
         gamma = self.gamma_slider.get_value()
-        transformed_img = c_gamma * (img.astype(np.float32) / 255) ** gamma
-        return np.clip(transformed_img * 255, 0, 255).astype(np.uint8)
+        return ("gamma", c_gamma, gamma)
 
     def apply_transformation_if(self, transformation_type):
         if self.transformation_var.get() == transformation_type:
-            self.apply_transformation()
+            self.apply_transformation(SLIDER_DEBOUNCE_MS)
 
-    def apply_transformation(self):
+    def apply_transformation(self, debounce_ms=0):
         if not hasattr(self.master, "image") or self.master.image is None:
             return
         transformation_type = self.transformation_var.get()
-        new_image = self.TRANSFORMATIONS[transformation_type](self, self.master.image)
-        self.image_viewer.set_image(new_image)
+        transforms = self.TRANSFORMATIONS[transformation_type](self)
+        transformation = lambda img: common.point_transform(img, *transforms)
+        image = self.master.image
+        # big images get a preview at the viewer's resolution first
+        proxy, step, bounds = self.image_viewer.get_preview_source(image)
+        if step == 1:
+            self.master.scheduler.submit(
+                "transformation",
+                lambda task: transformation(image),
+                self.image_viewer.set_image,
+                debounce_ms=debounce_ms,
+            )
+            return
+        self.master.scheduler.submit_progressive(
+            "transformation",
+            lambda task: transformation(proxy),
+            lambda preview: self.image_viewer.set_preview(preview, bounds),
+            lambda task: transformation(image),
+            self.image_viewer.set_image,
+            debounce_ms=debounce_ms,
+        )
 
 
 if __name__ == "__main__":
+    common.prepare_gui_kernels()
+
     viewer = ImageViewer()
     main_window = MainWindow("ToneMapping GUI", viewer)
 
@@ -1,15 +1,73 @@
-﻿import tkinter as tk
+﻿import numpy as np
+import tkinter as tk
 from tkinter import ttk
 import threading
-import matplotlib.pyplot as plt
+import traceback
+from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import (
     FigureCanvasTkAgg,
 )  # Required for embedding matplotlib figure
 
 from image_viewer import ImageViewer
-from gui_elements import SliderContainer, RadioContainer, MenuContainer, MainWindow
+from gui_elements import SliderContainer, RadioContainer, MenuContainer, MainWindow, SLIDER_DEBOUNCE_MS
 import common
 
+# the live mode polls the original viewer at its own refresh rate (50 fps)
+LIVE_INTERVAL_MS = 20
+
+class HistogramPlot:
+    # One figure and canvas per frame for the lifetime of the window. New
+    # counts only update the step artists, which are blitted over a cached
+    # background; a full redraw happens only when the y axis has to change.
+    def __init__(self, frame, labels, colors):
+        # a plain Figure is not registered with pyplot, so nothing accumulates
+        self.figure = Figure()
+        self.ax = self.figure.add_subplot()
+        edges = np.arange(257)
+        self.artists = [
+            self.ax.stairs(np.zeros(256), edges, label=label, alpha=0.6, color=color, fill=True, animated=True)
+            for label, color in zip(labels, colors)
+        ]
+        self.ax.legend()
+        self.ax.set_title("Histogram")
+        self.ax.set_xlabel("Pixel Value")
+        self.ax.set_ylabel("Frequency")
+        self.ax.set_xlim(0, 256)
+        self.y_max = 1.0
+        self.ax.set_ylim(0, self.y_max)
+
+        self.background = None
+        self.canvas = FigureCanvasTkAgg(self.figure, frame)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        self.canvas.draw()
+
+    def on_draw(self, event):
+        # every full draw (first show, resize, new y limits) refreshes the background
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
+
+    def update(self, hists):
+        for artist, counts in zip(self.artists, hists):
+            artist.set_data(counts)
+        top = max(float(counts.max()) for counts in hists)
+        # rescale with some headroom, and only when the data leaves the range
+        # or shrinks a lot, so most updates are a blit
+        if top > self.y_max or top < self.y_max / 4:
+            self.y_max = max(top * 1.2, 1.0)
+            self.ax.set_ylim(0, self.y_max)
+            self.canvas.draw_idle()
+            return
+        if self.background is None:
+            return
+        self.canvas.restore_region(self.background)
+        self.draw_artists()
+        self.canvas.blit(self.ax.bbox)
+
 
 class HistogramContainer(ttk.Frame):
     def __init__(self, master, image_viewer_original, image_viewer_equalized, **kwargs):
@@ -27,45 +85,149 @@ class HistogramContainer(ttk.Frame):
             fill=tk.BOTH, expand=True, side=tk.LEFT, padx=10
         )
 
+        self.histogram_plot = HistogramPlot(
+            self.canvas_frame, ["Blue", "Green", "Red", "Gray"], ["blue", "green", "red", "gray"]
+        )
+        self.histogram_plot_equalized = HistogramPlot(self.canvas_frame_equalized, ["Gray"], ["gray"])
+
         self.btn_update_histogram = ttk.Button(
             self, text="Equalize Histogram", command=self.update_histogram
         )
         self.btn_update_histogram.pack(pady=20)
 
-    def update_histogram(self):
-        image = self.image_viewer_original.get_roi()
-        if image is not None:
-            gray_image = common.simple_cvtColorBGRtoGray(image)
-            equalized_image = common.equalizeHist(gray_image)
-            self.image_viewer_equalized.set_image(equalized_image)
+        # live mode follows the original viewer's pan and zoom
+        self.live_var = tk.BooleanVar(value=False)
+        self.live_state = None
+        self.live_running = False
+        self.live_after = None
+        self.roi_histogram = common.RoiHistogram()
+        self.live_checkbox = ttk.Checkbutton(self, text="Live", variable=self.live_var, command=self.toggle_live)
+        self.live_checkbox.pack(pady=5)
+
+        self.mode_var = tk.StringVar(value="global")
+        self.mode_radio = RadioContainer(
+            self,
+            [
+                ("Global equalization", "global"),
+                ("Adaptive equalization (CLAHE)", "clahe"),
+            ],
+            self.mode_var,
+            command=self.update_histogram,
+        )
+        self.mode_radio.pack(pady=5, fill=tk.X)
+
+        self.clip_limit_slider = SliderContainer(
+            self,
+            "CLAHE clip limit:",
+            from_=1,
+            to=10,
+            orient=tk.HORIZONTAL,
+            callback=lambda val: self.update_histogram_if("clahe"),
+        )
+        self.clip_limit_slider.slider.set(2)
 
-            data = [gray_image.flatten()]
-            labels = ["Gray"]
-            colors = ["gray"]
-            self.plot_histogram(data, labels, colors, self.canvas_frame)
+    def toggle_live(self):
+        # one after() chain at a time, however fast the checkbox is toggled
+        if self.live_after is not None:
+            self.after_cancel(self.live_after)
+            self.live_after = None
+        if self.live_var.get():
+            self.live_state = None
+            self.live_tick()
 
-            data_eq = [equalized_image.flatten()]
-            self.plot_histogram(data_eq, labels, colors, self.canvas_frame_equalized)
+    def live_tick(self):
+        self.live_after = self.after(LIVE_INTERVAL_MS, self.live_tick)
+        self.live_update()
 
-    def plot_histogram(self, data, labels, colors, frame):
-        fig, ax = plt.subplots()
+    def live_update(self):
+        # At most one live job runs. While it does, ticks only let the viewer
+        # move on; when it finishes, the latest state is submitted right away.
+        # Superseding a running job instead would throw away every frame for
+        # as long as the user keeps panning.
+        viewer = self.image_viewer_original
+        image = viewer.get_image()
+        if not self.live_var.get() or self.live_running or image is None:
+            return
+        mode = self.mode_var.get()
+        clip_limit = self.clip_limit_slider.get_value()
+        state = (viewer.image_version, viewer.get_roi_bounds(), mode, clip_limit)
+        if state == self.live_state:
+            return
+        self.live_state = state
+        self.live_running = True
+        bounds = state[1]
+        self.master.scheduler.submit(
+            "live",
+            lambda task: self.equalize_live(task, image, bounds, mode, clip_limit),
+            self.show_live,
+            self.live_failed,
+        )
 
-        for d, label, color in zip(data, labels, colors):
-            ax.hist(d, bins=256, label=label, alpha=0.6, color=color, range=[0, 255])
-        ax.legend()
-        ax.set_title("Histogram")
-        ax.set_xlabel("Pixel Value")
-        ax.set_ylabel("Frequency")
+    def show_live(self, result):
+        self.live_running = False
+        self.show_histograms(result)
+        self.live_update()
 
-        for widget in frame.winfo_children():
-            widget.destroy()
+    def live_failed(self, error):
+        self.live_running = False
+        traceback.print_exception(error)
 
-        canvas = FigureCanvasTkAgg(fig, frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    def equalize_live(self, task, image, bounds, mode, clip_limit):
+        # runs on the scheduler, one live job at a time, so the running
+        # histogram is never updated concurrently
+        if mode == "clahe":
+            y1, y2, x1, x2 = bounds
+            return self.equalize(task, image[y1:y2, x1:x2], mode, clip_limit)
+        # the strips that entered and left the ROI since the last frame
+        hists = self.roi_histogram.update(image, bounds).copy()
+        y1, y2, x1, x2 = self.roi_histogram.bounds
+        gray_image = common.simple_cvtColorBGRtoGray(image[y1:y2, x1:x2])
+        task.check()
+        lut = common.equalization_lut(hists[3], gray_image.size)
+        equalized_image = common.apply_lut_parallel(gray_image, lut)
+        return hists, equalized_image, [common.equalized_histogram(hists[3], lut)]
+
+    def update_histogram_if(self, mode):
+        if self.mode_var.get() == mode:
+            self.update_histogram(SLIDER_DEBOUNCE_MS)
+
+    def update_histogram(self, debounce_ms=0):
+        image = self.image_viewer_original.get_roi()
+        if image is not None:
+            mode = self.mode_var.get()
+            clip_limit = self.clip_limit_slider.get_value()
+            self.master.scheduler.submit(
+                "histogram",
+                lambda task: self.equalize(task, image, mode, clip_limit),
+                self.show_histograms,
+                debounce_ms=debounce_ms,
+            )
+
+    def equalize(self, task, image, mode, clip_limit):
+        # runs on the scheduler
+        # B, G, R and gray counts come from one pass over the ROI view
+        hists = common.histogram_bgr(image)
+        gray_image = common.simple_cvtColorBGRtoGray(image)
+        task.check()
+        if mode == "clahe":
+            equalized_image = common.equalizeHistCLAHE(gray_image, clip_limit)
+            hist_eq = [common.histogram_parallel(equalized_image)]
+        else:
+            lut = common.equalization_lut(hists[3], gray_image.size)
+            equalized_image = common.apply_lut_parallel(gray_image, lut)
+            hist_eq = [common.equalized_histogram(hists[3], lut)]
+        return hists, equalized_image, hist_eq
+
+    def show_histograms(self, result):
+        hists, equalized_image, hist_eq = result
+        self.image_viewer_equalized.set_image(equalized_image)
+        self.histogram_plot.update(hists)
+        self.histogram_plot_equalized.update(hist_eq)
 
 
 if __name__ == "__main__":
+    common.prepare_gui_kernels()
+
     viewer_original = ImageViewer("Original Image")
     viewer_equalized = ImageViewer("Equalized Image")
 
@@ -1,6 +1,5 @@
 ﻿import numpy as np
 import tkinter as tk
-import math
 from tkinter import ttk, messagebox, simpledialog
 import threading
 import matplotlib.pyplot as plt
@@ -8,7 +7,7 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from image_viewer import ImageViewer
 from gui_elements import SliderContainer, RadioContainer, MenuContainer, MainWindow
 import common
-from common import fft2, fftshift, ifftshift, ifft2
+from common import rfft2_batch, irfft2_batch, fftshift, full_magnitude
 
 
 class FourierContainer(ttk.Frame):
@@ -17,6 +16,13 @@ class FourierContainer(ttk.Frame):
         self.image_viewer_original = image_viewer_original
         self.image_viewer_transformed = image_viewer_transformed
         self.image_viewer_filter = image_viewer_filter
+        self.filter_params = None
+        # (key, padded shape, crop, half spectra, magnitude) of the last ROI
+        self.spectrum_cache = None
+        # how the ROI is extended to a fast FFT size: "reflect" or "constant"
+        self.padding_mode = "reflect"
+        self.plotted_spectrum_key = None
+        self.colour_var = tk.BooleanVar(value=False)
         self.init_ui()
 
     def init_ui(self):
@@ -32,6 +38,10 @@ class FourierContainer(ttk.Frame):
         self.btn_fourier_transform = ttk.Button(self, text="Compute Fourier Transform", command=self.compute_transform)
         self.btn_fourier_transform.pack(pady=20)
 
+        # filters B, G and R separately instead of the grayscale image
+        self.colour_checkbox = ttk.Checkbutton(self, text="Colour", variable=self.colour_var, command=self.compute_transform)
+        self.colour_checkbox.pack()
+
         # Listbox for Filters
         self.listbox = tk.Listbox(self)
         self.listbox.pack(pady=20)
@@ -46,89 +56,97 @@ class FourierContainer(ttk.Frame):
 
     def on_filter_select(self, event):
         index = self.listbox.curselection()
+        if not index:
+            return
+        kind = common.FREQUENCY_MASKS[index[0]]
 
-        if self.image_viewer_original.get_image() is None:
-            width = 100
-            height = 100
+        if kind.startswith("gaussian"):
+            radius = simpledialog.askinteger("", "Ширина Гаусівської кривої:")
         else:
-            width = self.image_viewer_original.width()
-            height = self.image_viewer_original.height()
+            radius = simpledialog.askinteger("", "Радіус:")
+        if not radius:
+            return
+
+        order = 1
+        if kind.startswith("butterworth"):
+            order = simpledialog.askinteger("", "Порядок степені:")
+            if not order:
+                return
+
+        self.filter_params = (kind, radius, order)
+        shape = self.mask_shape()
+        self.master.scheduler.submit(
+            "mask",
+            lambda task: (common.frequency_mask(shape, kind, radius, order) * 255).astype(np.uint8),
+            self.image_viewer_filter.set_image,
+        )
+        # with a cached spectrum a new mask is one multiply and an inverse FFT
+        if self.image_viewer_original.get_image() is not None:
+            self.compute_transform()
+
+    def mask_shape(self):
+        # the mask is applied to the padded grayscale ROI, so it is built at its size
+        image = self.image_viewer_original.get_image()
+        if image is None:
+            return (100, 100)
+        rows, cols = self.image_viewer_original.get_roi().shape[:2]
+        return common.next_fast_length(rows), common.next_fast_length(cols)
+
+    def get_spectrum(self, key, roi, colour):
+        # the spectrum only changes with the image or the viewport; runs on the
+        # scheduler, which never runs two "transform" jobs at once
+        if self.spectrum_cache is None or self.spectrum_cache[0] != key:
+            if colour and roi.ndim == 3:
+                # (C, H, W), all channels go through one batched transform
+                stack = roi.transpose(2, 0, 1)
+            else:
+                stack = common.simple_cvtColorBGRtoGray(roi)[np.newaxis]
+            # padded to power-of-two sides so the FFT time doesn't depend on the zoom
+            padded_stack, crop = common.pad_to_fast_shape(stack, self.padding_mode)
+            # the image is real, so only the non-negative column frequencies are computed
+            f = rfft2_batch(padded_stack)
+            shape = padded_stack.shape[1:]
+            # for colour the plot shows the mean of the channels, which is the spectrum of their average
+            magnitude_spectrum = 20 * np.log(fftshift(full_magnitude(f.mean(axis=0), shape[1])))
+            self.spectrum_cache = (key, shape, crop, f, magnitude_spectrum)
+        return self.spectrum_cache
 
-        if not index:
-            index = 0;
-            return;
+    def compute_transform(self):
+        viewer = self.image_viewer_original
+        if viewer.get_image() is not None:
+            colour = self.colour_var.get()
+            key = (viewer.image_version, viewer.get_image().shape, viewer.get_roi_bounds(), colour)
+            roi = viewer.get_roi()
+            filter_params = self.filter_params
+            self.master.scheduler.submit(
+                "transform",
+                lambda task: self.filter_spectrum(task, key, roi, colour, filter_params),
+                self.show_transform,
+            )
+
+    def filter_spectrum(self, task, key, roi, colour, filter_params):
+        key, shape, crop, f, magnitude_spectrum = self.get_spectrum(key, roi, colour)
+        task.check()
+
+        # Apply mask and inverse DFT; the mask is laid out like the unshifted
+        # half spectrum and broadcasts over the channels
+        if filter_params is not None:
+            f = f * common.half_frequency_mask(tuple(shape), *filter_params)
+        img_back = irfft2_batch(f, shape[1])[crop]
+        img_back = np.abs(img_back).astype(np.uint8)
+
+        if img_back.shape[0] == 1:
+            img_back = img_back[0]
         else:
-            index = index[0]
-
-        # Sample frequency filtering using a mask
-        rows, cols = width, height
-        crow, ccol = rows // 2, cols // 2
-        self.mask = np.ones((rows, cols), np.double)
-
-        if index == 0:
-
-            radius = int(simpledialog.askinteger("", "Радіус:"))
-
-            for indY in range(self.mask.shape[1]):
-                for indX in range(self.mask.shape[0]):
-                    value = self.D(indX, indY, width, height)
-                    self.mask[indY][indX] = value <= radius if 1 else 0
-
-        elif index == 1:
-            radius = int(simpledialog.askinteger("", "Радіус:"))
-
-            for indY in range(self.mask.shape[1]):
-                for indX in range(self.mask.shape[0]):
-                    value = self.D(indX, indY, width, height)
-                    self.mask[indY][indX] = value >= radius if 1 else 0
+            img_back = np.ascontiguousarray(img_back.transpose(1, 2, 0))
+        return key, img_back, magnitude_spectrum
 
-        elif index == 2 or index == 3:
-            radius = int(simpledialog.askinteger("", "Радіус:"))
-            powOrder = int(simpledialog.askinteger("", "Порядок степені:"))
-
-            for indY in range(self.mask.shape[1]):
-                for indX in range(self.mask.shape[0]):
-                    value = self.D(indX, indY, width, height)
-                    self.mask[indY][indX] = 1/ (1 + pow(value / radius, powOrder * 2))
-
-            if index == 3:
-                self.mask = 1 - self.mask
-
-        elif index == 4 or index == 5:
-            radius = int(simpledialog.askinteger("", "Ширина Гаусівської кривої:"))
-
-            for indY in range(self.mask.shape[1]):
-                for indX in range(self.mask.shape[0]):
-                    value = self.D(indX, indY, width, height)
-                    self.mask[indY][indX] = math.exp(-(value**2) / (2*(radius ** 2)))
-
-            if index == 5:
-                self.mask = 1 - self.mask
-
-        self.image_viewer_filter.set_image(self.mask * 255)
-    
-    def D(self, u, v, M, N):
-        return math.sqrt((u - N / 2)**2 + (v - N / 2)**2) 
-
-    def compute_transform(self):
-        image = self.image_viewer_original.get_roi()
-        if image is not None:
-            gray_image = common.simple_cvtColorBGRtoGray(image)
-            f = fft2(gray_image)
-            fshift = fftshift(f)
-            magnitude_spectrum = 20 * np.log(np.abs(fshift))
-            
-            if self.mask is None:
-                self.on_filter_select(None)
-
-            # Apply mask and inverse DFT
-            fshift = fshift * self.mask
-            f_ishift = ifftshift(fshift)
-            img_back = ifft2(f_ishift)
-            img_back = np.abs(img_back)
-
-            self.image_viewer_transformed.set_image(img_back.astype(np.uint8))
+    def show_transform(self, result):
+        key, img_back, magnitude_spectrum = result
+        self.image_viewer_transformed.set_image(img_back)
+        if self.plotted_spectrum_key != key:
             self.plot_image(magnitude_spectrum, 'Fourier Spectrum', self.canvas_frame_transformed)
+            self.plotted_spectrum_key = key
 
     def plot_image(self, image, title, frame):
         fig, ax = plt.subplots()
@@ -143,6 +161,8 @@ class FourierContainer(ttk.Frame):
 
 if __name__ == "__main__":
 
+    common.prepare_gui_kernels()
+
     plt.style.use('dark_background')
 
     viewer_original = ImageViewer("Original Image")
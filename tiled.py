@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+import cv2
+
+import common
+
+# Out-of-core processing for images that don't fit in RAM. A TiledImage is a
+# memory-mapped .npy (or headerless raw) file, and every operation streams
+# over it in full-width row bands, so only one band, its halo rows and the
+# matching output band are in memory at a time. Row bands keep the reads
+# sequential in the file and the column borders are handled by the in-memory
+# kernels as usual.
+TILE_BYTES = 64 * 1024 * 1024
+
+
+class TiledImage:
+    def __init__(self, array, path=None):
+        self.array = array
+        self.path = path
+
+    @classmethod
+    def open(cls, path, mode="r", shape=None, dtype=np.uint8):
+        # .npy files carry their shape and dtype, raw files need them given.
+        # The default mode "r" maps the file read-only, so the bands handed to
+        # the common kernels are read-only arrays, except the edge bands that
+        # np.pad copies; every kernel has to accept both.
+        if path.endswith(".npy"):
+            return cls(np.load(path, mmap_mode=mode), path)
+        if shape is None:
+            raise ValueError("a raw image needs its shape")
+        return cls(np.memmap(path, dtype=dtype, mode=mode, shape=tuple(shape)), path)
+
+    @classmethod
+    def create(cls, path, shape, dtype=np.uint8):
+        return cls(open_memmap(path, mode="w+", dtype=dtype, shape=tuple(shape)), path)
+
+    @classmethod
+    def from_image(cls, image_path, path):
+        # converts a regular image file once; cv2 decodes it whole, so this is
+        # the only step that needs the full image in RAM
+        image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError(f"can't read {image_path!r}")
+        tiled = cls.create(path, image.shape, image.dtype)
+        tiled.array[:] = image
+        tiled.flush()
+        return tiled
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    @property
+    def dtype(self):
+        return self.array.dtype
+
+    def flush(self):
+        if isinstance(self.array, np.memmap):
+            self.array.flush()
+
+    def tile_rows(self, tile_bytes=TILE_BYTES):
+        row_bytes = self.array[:1].nbytes
+        return max(1, min(self.shape[0], tile_bytes // max(row_bytes, 1)))
+
+    def tiles(self, halo=0, border="constant", tile_bytes=TILE_BYTES):
+        # yields (start, end, band): band holds rows [start - halo, end + halo),
+        # with the rows past the image edges filled by the border mode
+        h = self.shape[0]
+        rows = self.tile_rows(tile_bytes)
+        mode = common.NUMPY_PAD_MODES[common.BORDER_MODES[border]]
+        for start in range(0, h, rows):
+            end = min(start + rows, h)
+            top, bottom = max(start - halo, 0), min(end + halo, h)
+            band = np.asarray(self.array[top:bottom])
+            missing = (halo - (start - top), halo - (bottom - end))
+            if missing != (0, 0):
+                padding = (missing,) + ((0, 0),) * (band.ndim - 1)
+                band = np.pad(band, padding, mode=mode)
+            yield start, end, band
+
+
+def filter2D(source, kernel, path, border="constant", fixed_point=True, tile_bytes=TILE_BYTES):
+    halo = kernel.shape[0] // 2
+    # chosen once for the whole image, a band on its own could get another
+    # method and round differently
+    method = common.select_filter2D_method(source.shape, np.asarray(kernel, dtype=np.float32))
+    output = TiledImage.create(path, source.shape, np.uint8)
+    for start, end, band in source.tiles(halo, border, tile_bytes):
+        filtered = common.filter2D(band, kernel, border, fixed_point, method)
+        output.array[start:end] = filtered[halo:halo + end - start]
+    output.flush()
+    return output
+
+def cvtColorBGRtoGray(source, path, tile_bytes=TILE_BYTES):
+    output = TiledImage.create(path, source.shape[:2], np.uint8)
+    for start, end, band in source.tiles(tile_bytes=tile_bytes):
+        output.array[start:end] = common.simple_cvtColorBGRtoGray(band)
+    output.flush()
+    return output
+
+def apply_lut(source, lut, path, tile_bytes=TILE_BYTES):
+    output = TiledImage.create(path, source.shape, lut.dtype)
+    for start, end, band in source.tiles(tile_bytes=tile_bytes):
+        output.array[start:end] = common.apply_lut_parallel(band, lut)
+    output.flush()
+    return output
+
+def histogram(source, tile_bytes=TILE_BYTES):
+    hist = None
+    for start, end, band in source.tiles(tile_bytes=tile_bytes):
+        band_hist = common.histogram_parallel(band)
+        hist = band_hist if hist is None else hist + band_hist
+    return hist
+
+def equalizeHist(source, path, tile_bytes=TILE_BYTES):
+    # two passes over the file: the global histogram, then the LUT
+    hist = histogram(source, tile_bytes)
+    lut = common.equalization_lut(hist, source.shape[0] * source.shape[1])
+    return apply_lut(source, lut, path, tile_bytes)
+
+def remove(tiled):
+    # drops the mapping before deleting, Windows won't delete a mapped file
+    path = tiled.path
+    tiled.array = None
+    if path is not None and os.path.exists(path):
+        os.remove(path)